@@ -3,31 +3,131 @@ LAB MONITORING CLOUD AI - 3 SENSOR (MQ135, MQ2, MQ7)
 Streamlit Dashboard with ML Prediction
 """
 
-import json
 import time
-import queue
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import joblib
 import altair as alt
+import orjson
 import paho.mqtt.client as mqtt
 
+try:
+    import onnxruntime as ort
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+except ImportError:
+    ort = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # --- Configuration ---
 BROKER = "broker.hivemq.com"
 PORT = 1883
 TOPIC_DATA = "net4think/lab_monitor/data"
-TOPIC_PRED_MQ135 = "net4think/lab_monitor/pred_mq135"
-TOPIC_PRED_MQ2 = "net4think/lab_monitor/pred_mq2"
-TOPIC_PRED_MQ7 = "net4think/lab_monitor/pred_mq7"
+TOPIC_PRED_ALL = "net4think/lab_monitor/pred"
+
+# Display timezone (Western Indonesia Time, UTC+7)
+WIB = timezone(timedelta(hours=7))
+
+# Max readings buffered between reruns
+MQTT_QUEUE_SIZE = 10000
 
 # Model Files
 MODEL_MQ135 = "air_quality_rf_model.joblib"
 MODEL_MQ2 = "model_mq2.joblib"
 MODEL_MQ7 = "model_mq7.joblib"
 
+# Seconds between checks for new MQTT data
+REFRESH_INTERVAL = 2
+
+# Batches at least this large run the three models in parallel
+PARALLEL_BATCH = 32
+
+# Initial row capacity of the per-session model input buffers
+INPUT_CAPACITY = 64
+
+# History ring buffer: number of readings kept for charts / CSV export,
+# stored column-wise as one preallocated array per column
+HISTORY_SIZE = 1000
+HISTORY_COLUMNS = {
+    "time": "U8",
+    "Temp": np.float32, "Hum": np.float32,
+    "MQ135": np.float32, "MQ2": np.float32, "MQ7": np.float32,
+    "Status_135": "U16", "Status_MQ2": "U16", "Status_MQ7": "U16",
+}
+
+# Sensor cards: (color, icon, label text) per predicted class, so rendering
+# is a dict lookup; labels without an entry fall back to a neutral card
+CARD_TITLE = {
+    "mq135": "MQ-135 (Air Quality)",
+    "mq2": "MQ-2 (Smoke Detection)",
+    "mq7": "MQ-7 (CO/Gas Detection)",
+}
+CARD_STYLE = {
+    "mq135": {
+        "Baik": ("#10b981", "💨", "Baik"),
+        "Sedang": ("#f59e0b", "💨", "Sedang"),
+        "Tidak_Sehat": ("#ef4444", "💨", "Tidak Sehat"),
+        "Berbahaya": ("#ef4444", "💨", "Berbahaya"),
+    },
+    # Labels translated to Indonesian
+    "mq2": {
+        "smoke": ("#ef4444", "🔥", "BAHAYA!"),
+        "no_smoke": ("#10b981", "✅", "AMAN"),
+    },
+    "mq7": {
+        "smoke": ("#ef4444", "☠️", "BERBAHAYA!"),
+        "no_smoke": ("#10b981", "✅", "NORMAL"),
+    },
+}
+CARD_TEMPLATE = """
+    <div class="sensor-card" style="background: linear-gradient(135deg, {color}, {color}cc);">
+        <h4 style="margin:0; opacity:0.9;">{icon} {title}</h4>
+        <h2 style="margin:10px 0; font-size:2rem;">{label}</h2>
+        <p style="margin:0;">Confidence: {confidence}%</p>
+        <p style="margin:5px 0 0 0; font-size:1.5rem;">{ppm:.1f} ppm</p>
+    </div>
+    """
+
+# Page-wide styling and header markup
+CSS_BLOCK = """
+<style>
+@import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap');
+html, body, [class*="css"] { font-family: 'Poppins', sans-serif; }
+.main-header { font-size: 2.5rem; font-weight: 600; color: #1e3a8a; text-align: center; }
+.metric-card {
+    background: white; padding: 20px; border-radius: 16px;
+    box-shadow: 0 4px 20px rgba(0,0,0,0.05); text-align: center;
+    border: 1px solid #e2e8f0; margin-bottom: 10px;
+}
+.metric-value { font-size: 2rem; font-weight: 700; color: #0f172a; }
+.metric-label { font-size: 0.9rem; color: #64748b; text-transform: uppercase; }
+.sensor-card {
+    padding: 20px; border-radius: 16px; color: white; text-align: center;
+    box-shadow: 0 8px 25px rgba(0,0,0,0.15); margin-bottom: 15px;
+}
+</style>
+"""
+HEADER_HTML = (
+    '<div class="main-header">🧪 Lab Monitoring AI Dashboard</div>'
+    '<p style="text-align:center; color:#64748b;">Real-time Chemical Lab Safety Monitoring with 3 ML Models</p>'
+)
+
+# Chart color scale for the gas sensor lines
+SENSOR_SCALE = alt.Scale(
+    domain=['MQ135', 'MQ2', 'MQ7'],
+    range=['#3b82f6', '#ef4444', '#f59e0b']
+)
+
 st.set_page_config(
     page_title="Lab Monitor AI",
     page_icon="🧪",
@@ -35,9 +135,6 @@ st.set_page_config(
 )
 
 # --- State Management ---
-if 'mqtt_queue' not in st.session_state:
-    st.session_state.mqtt_queue = queue.Queue()
-
 if 'sensor_data' not in st.session_state:
     st.session_state.sensor_data = {
         "temp": 0, "hum": 0, 
@@ -53,9 +150,103 @@ if 'predictions' not in st.session_state:
     }
 
 if 'history' not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = {
+        col: np.empty(HISTORY_SIZE, dtype=dtype) for col, dtype in HISTORY_COLUMNS.items()
+    }
+    st.session_state.hist_head = 0
+    st.session_state.hist_filled = 0
+    # Set when new readings arrive; the chart/table snapshot is rebuilt only then
+    st.session_state.dirty = True
+
+if 'model_inputs' not in st.session_state:
+    # Reusable float32 model inputs, grown when a drained batch is larger
+    st.session_state.model_inputs = {
+        "mq135": np.empty((INPUT_CAPACITY, 3), dtype=np.float32),
+        "mq2": np.empty((INPUT_CAPACITY, 1), dtype=np.float32),
+        "mq7": np.empty((INPUT_CAPACITY, 1), dtype=np.float32)
+    }
 
 # --- Model Loading ---
+def compile_onnx(model, n_features):
+    """Compile a fitted sklearn classifier to an ONNX Runtime session"""
+    if ort is None:
+        return None
+    
+    try:
+        onnx_model = convert_sklearn(
+            model,
+            initial_types=[('X', FloatTensorType([None, n_features]))],
+            options={id(model): {'zipmap': False}}
+        )
+        # One thread per session: the three models already run side by side
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        return ort.InferenceSession(
+            onnx_model.SerializeToString(), options, providers=['CPUExecutionProvider']
+        )
+    except Exception as e:
+        print(f"⚠️ ONNX conversion failed, using scikit-learn: {e}")
+        return None
+
+@st.cache_resource
+def forest_kernel():
+    """JIT-compiled random forest predict_proba over padded per-tree node arrays"""
+    if njit is None:
+        return None
+    
+    # nogil so MQ-2 and MQ-7 can run side by side in the prediction pool
+    @njit(nogil=True)
+    def forest_proba(X, feature, threshold, left, right, value):
+        n_trees = feature.shape[0]
+        proba = np.zeros((X.shape[0], value.shape[2]))
+        for i in range(X.shape[0]):
+            for t in range(n_trees):
+                node = 0
+                while left[t, node] != -1:
+                    if X[i, feature[t, node]] <= threshold[t, node]:
+                        node = left[t, node]
+                    else:
+                        node = right[t, node]
+                proba[i] += value[t, node]
+        return proba / n_trees
+    
+    # Compile once here instead of on the first reading
+    forest_proba(
+        np.zeros((1, 1), dtype=np.float32), np.zeros((1, 1), dtype=np.int64),
+        np.zeros((1, 1)), np.full((1, 1), -1, dtype=np.int64),
+        np.full((1, 1), -1, dtype=np.int64), np.ones((1, 1, 2))
+    )
+    return forest_proba
+
+def compile_forest(model):
+    """Export a fitted RandomForestClassifier's trees for forest_kernel()"""
+    try:
+        # Compiling the kernel can fail too; fall back like a failed export
+        kernel = forest_kernel()
+        if kernel is None:
+            return None
+        
+        trees = [est.tree_ for est in model.estimators_]
+        shape = (len(trees), max(tree.node_count for tree in trees))
+        feature = np.zeros(shape, dtype=np.int64)
+        threshold = np.zeros(shape)
+        left = np.full(shape, -1, dtype=np.int64)
+        right = np.full(shape, -1, dtype=np.int64)
+        value = np.zeros(shape + (len(model.classes_),))
+        for t, tree in enumerate(trees):
+            k = tree.node_count
+            # Leaves store feature -2; any index is fine since they are never split
+            feature[t, :k] = np.maximum(tree.feature, 0)
+            threshold[t, :k] = tree.threshold
+            left[t, :k] = tree.children_left
+            right[t, :k] = tree.children_right
+            leaf_value = tree.value[:, 0, :]
+            value[t, :k] = leaf_value / leaf_value.sum(axis=1, keepdims=True)
+        return lambda X: kernel(X, feature, threshold, left, right, value)
+    except Exception as e:
+        print(f"⚠️ Numba forest export failed: {e}")
+        return None
+
 @st.cache_resource
 def load_models():
     """Load all ML models"""
@@ -64,10 +255,14 @@ def load_models():
     # MQ-135 Model (with label encoder)
     try:
         artifact = joblib.load(MODEL_MQ135)
+        artifact["model"].set_params(n_jobs=1)
         models['mq135'] = {
             'model': artifact["model"],
             'label_encoder': artifact["label_encoder"],
-            'features': artifact["features"]
+            'features': artifact["features"],
+            # Decoded label for each predict_proba column
+            'classes': artifact["label_encoder"].inverse_transform(artifact["model"].classes_),
+            'session': compile_onnx(artifact["model"], len(artifact["features"]))
         }
         print("✅ MQ-135 model loaded")
     except Exception as e:
@@ -76,7 +271,13 @@ def load_models():
     
     # MQ-2 Model (simple RF)
     try:
-        models['mq2'] = joblib.load(MODEL_MQ2)
+        model = joblib.load(MODEL_MQ2).set_params(n_jobs=1)
+        # Single-feature forests: JIT tree walk when numba is available
+        forest = compile_forest(model)
+        models['mq2'] = {
+            'model': model, 'classes': model.classes_, 'forest': forest,
+            'session': compile_onnx(model, 1) if forest is None else None
+        }
         print("✅ MQ-2 model loaded")
     except Exception as e:
         print(f"❌ MQ-2 model error: {e}")
@@ -84,7 +285,13 @@ def load_models():
     
     # MQ-7 Model (simple RF)
     try:
-        models['mq7'] = joblib.load(MODEL_MQ7)
+        model = joblib.load(MODEL_MQ7).set_params(n_jobs=1)
+        # Single-feature forests: JIT tree walk when numba is available
+        forest = compile_forest(model)
+        models['mq7'] = {
+            'model': model, 'classes': model.classes_, 'forest': forest,
+            'session': compile_onnx(model, 1) if forest is None else None
+        }
         print("✅ MQ-7 model loaded")
     except Exception as e:
         print(f"❌ MQ-7 model error: {e}")
@@ -94,6 +301,11 @@ def load_models():
 
 models = load_models()
 
+@st.cache_resource
+def get_executor():
+    """Shared worker pool for running the three models concurrently"""
+    return ThreadPoolExecutor(max_workers=3, thread_name_prefix="predict")
+
 # --- MQTT Setup ---
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
@@ -103,209 +315,190 @@ def on_connect(client, userdata, flags, rc, properties=None):
         print(f"Failed to connect, return code {rc}")
 
 def on_message(client, userdata, msg):
+    # Runs on the paho network thread: decode and coerce here so the
+    # Streamlit rerun only has to dequeue ready-to-use readings
     try:
-        payload = json.loads(msg.payload.decode())
+        payload = orjson.loads(msg.payload)
+        reading = (
+            float(payload.get("temperature", 0)), float(payload.get("humidity", 0)),
+            float(payload.get("mq135_ppm", 0)), float(payload.get("mq2_ppm", 0)),
+            float(payload.get("mq7_ppm", 0)), time.time()
+        )
         if userdata is not None:
-            userdata.put((msg.topic, payload))
+            userdata.append((msg.topic, reading))
     except Exception as e:
         print(f"MQTT Error: {e}")
 
 @st.cache_resource
 def start_mqtt():
+    """Connect once and bind the message queue to the client; returns (client, queue)"""
+    # deque append/popleft are atomic, so the single paho producer and the
+    # Streamlit consumer need no lock; the oldest readings drop on overflow
+    mqtt_queue = deque(maxlen=MQTT_QUEUE_SIZE)
     unique_id = f"Streamlit_Lab_{uuid.uuid4().hex[:8]}"
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=unique_id, clean_session=True)
     client.on_connect = on_connect
     client.on_message = on_message
+    client.user_data_set(mqtt_queue)
     try:
         client.connect(BROKER, PORT, 60)
         client.loop_start()
-        return client
+        return client, mqtt_queue
     except Exception as e:
         st.error(f"MQTT Connection Error: {e}")
-        return None
+        return None, mqtt_queue
 
-mqtt_client = start_mqtt()
-if mqtt_client:
-    mqtt_client.user_data_set(st.session_state.mqtt_queue)
+mqtt_client, st.session_state.mqtt_queue = start_mqtt()
 
 # --- Prediction Functions ---
-def predict_mq135(temp, hum, gas):
-    """Predict air quality using MQ-135 model"""
-    if models['mq135'] is None:
-        return "N/A", 0
-    
-    try:
-        m = models['mq135']
-        input_df = pd.DataFrame([[temp, hum, gas]], columns=m['features'])
-        pred_idx = m['model'].predict(input_df)[0]
-        label = m['label_encoder'].inverse_transform([pred_idx])[0]
-        proba = m['model'].predict_proba(input_df)[0]
-        confidence = round(proba[pred_idx] * 100, 1)
-        return label, confidence
-    except Exception as e:
-        print(f"MQ135 prediction error: {e}")
-        return "Error", 0
-
-def predict_mq2(mq2_ppm):
-    """Predict smoke using MQ-2 model"""
-    if models['mq2'] is None:
-        return "N/A", 0
-    
-    try:
-        pred = models['mq2'].predict([[mq2_ppm]])[0]
-        proba = models['mq2'].predict_proba([[mq2_ppm]])[0]
-        confidence = round(max(proba) * 100, 1)
-        return pred, confidence
-    except Exception as e:
-        print(f"MQ2 prediction error: {e}")
-        return "Error", 0
-
-def predict_mq7(mq7_ppm):
-    """Predict CO/gas using MQ-7 model"""
-    if models['mq7'] is None:
-        return "N/A", 0
+def predict_proba(m, X):
+    """Class probabilities for a float32 batch, via numba or ONNX Runtime when available"""
+    if m.get('forest') is not None:
+        return m['forest'](X)
+    if m['session'] is not None:
+        # ORT returns float32; widen so rounded confidences stay short
+        return m['session'].run(['probabilities'], {'X': X})[0].astype(np.float64)
+    if 'features' in m:
+        X = pd.DataFrame(X, columns=m['features'])
+    return m['model'].predict_proba(X)
+
+def predict(key, X):
+    """Predict a batch with one sensor model ([temp, hum, gas] rows for mq135, [ppm] for mq2/mq7)"""
+    n = len(X)
+    if models[key] is None:
+        return ["N/A"] * n, [0] * n
     
     try:
-        pred = models['mq7'].predict([[mq7_ppm]])[0]
-        proba = models['mq7'].predict_proba([[mq7_ppm]])[0]
-        confidence = round(max(proba) * 100, 1)
-        return pred, confidence
+        m = models[key]
+        # RF predict() is argmax over predict_proba(); compute it once
+        proba = predict_proba(m, X)
+        col = proba.argmax(axis=1)
+        labels = m['classes'][col]
+        confidence = np.round(proba[np.arange(n), col] * 100, 1)
+        return labels.tolist(), confidence.tolist()
     except Exception as e:
-        print(f"MQ7 prediction error: {e}")
-        return "Error", 0
+        print(f"{key.upper()} prediction error: {e}")
+        return ["Error"] * n, [0] * n
 
 # --- Data Processing ---
-while not st.session_state.mqtt_queue.empty():
-    topic, payload = st.session_state.mqtt_queue.get()
+def wib_clock(ts):
+    """HH:MM:SS in WIB for a receive timestamp"""
+    wib_time = datetime.fromtimestamp(ts, WIB)
+    return f"{wib_time.hour:02d}:{wib_time.minute:02d}:{wib_time.second:02d}"
+
+# Drain the whole queue first so every model is called once per batch
+# instead of once per message.
+batch = []
+try:
+    while True:
+        topic, reading = st.session_state.mqtt_queue.popleft()
+        if topic == TOPIC_DATA:
+            batch.append(reading)
+except IndexError:
+    pass
+
+if batch:
+    # Columns: temp, hum, mq135, mq2, mq7 (sensor precision fits float32;
+    # received_at does not and is read from the tuple instead)
+    readings = np.array(batch, dtype=np.float32)[:, :5]
     
-    if topic == TOPIC_DATA:
-        # Parse Data
-        temp = float(payload.get("temperature", 0))
-        hum = float(payload.get("humidity", 0))
-        mq135 = float(payload.get("mq135_ppm", 0))
-        mq2 = float(payload.get("mq2_ppm", 0))
-        mq7 = float(payload.get("mq7_ppm", 0))
-        
-        wib_time = datetime.now(timezone.utc) + timedelta(hours=7)
-        timestamp = wib_time.strftime("%H:%M:%S")
-
-        # Update State
-        st.session_state.sensor_data = {
-            "temp": temp, "hum": hum,
-            "mq135": mq135, "mq2": mq2, "mq7": mq7,
-            "timestamp": timestamp
-        }
-        
-        # Predictions
-        label_mq135, conf_mq135 = predict_mq135(temp, hum, mq135)
-        label_mq2, conf_mq2 = predict_mq2(mq2)
-        label_mq7, conf_mq7 = predict_mq7(mq7)
-        
-        st.session_state.predictions = {
-            "mq135": {"label": label_mq135, "confidence": conf_mq135},
-            "mq2": {"label": label_mq2, "confidence": conf_mq2},
-            "mq7": {"label": label_mq7, "confidence": conf_mq7}
-        }
-
-        # Publish Predictions to MQTT
-        if mqtt_client:
-            mqtt_client.publish(TOPIC_PRED_MQ135, json.dumps({
-                "label": label_mq135, "confidence": conf_mq135
-            }))
-            mqtt_client.publish(TOPIC_PRED_MQ2, json.dumps({
-                "label": label_mq2, "confidence": conf_mq2
-            }))
-            mqtt_client.publish(TOPIC_PRED_MQ7, json.dumps({
-                "label": label_mq7, "confidence": conf_mq7
-            }))
-        
-        # Update History
-        new_record = {
-            "time": timestamp,
-            "Temp": temp, "Hum": hum,
-            "MQ135": mq135, "MQ2": mq2, "MQ7": mq7,
-            "Status_135": label_mq135,
-            "Status_MQ2": label_mq2,
-            "Status_MQ7": label_mq7
+    inputs = st.session_state.model_inputs
+    if len(batch) > len(inputs['mq135']):
+        inputs = st.session_state.model_inputs = {
+            key: np.empty((len(batch), buf.shape[1]), dtype=np.float32)
+            for key, buf in inputs.items()
         }
-        st.session_state.history.append(new_record)
-        
-        if len(st.session_state.history) > 1000:
-            st.session_state.history.pop(0)
+    X135 = inputs['mq135'][:len(batch)]
+    X2 = inputs['mq2'][:len(batch)]
+    X7 = inputs['mq7'][:len(batch)]
+    X135[:] = readings[:, 0:3]
+    X2[:, 0] = readings[:, 3]
+    X7[:, 0] = readings[:, 4]
+    
+    temp, hum, mq135, mq2, mq7, received_at = batch[-1]
+    timestamp = wib_clock(received_at)
+    
+    # Predictions (large backlogs run the models concurrently; both ONNX
+    # Runtime and sklearn's tree code release the GIL)
+    if len(batch) >= PARALLEL_BATCH:
+        executor = get_executor()
+        futures = [
+            executor.submit(predict, 'mq135', X135),
+            executor.submit(predict, 'mq2', X2),
+            executor.submit(predict, 'mq7', X7)
+        ]
+        (labels_mq135, confs_mq135), (labels_mq2, confs_mq2), (labels_mq7, confs_mq7) = (
+            f.result() for f in futures
+        )
+    else:
+        labels_mq135, confs_mq135 = predict('mq135', X135)
+        labels_mq2, confs_mq2 = predict('mq2', X2)
+        labels_mq7, confs_mq7 = predict('mq7', X7)
+    
+    # Update State (latest sample only)
+    label_mq135, conf_mq135 = labels_mq135[-1], confs_mq135[-1]
+    label_mq2, conf_mq2 = labels_mq2[-1], confs_mq2[-1]
+    label_mq7, conf_mq7 = labels_mq7[-1], confs_mq7[-1]
+    
+    st.session_state.sensor_data = {
+        "temp": temp, "hum": hum,
+        "mq135": mq135, "mq2": mq2, "mq7": mq7,
+        "timestamp": timestamp
+    }
+    
+    st.session_state.predictions = {
+        "mq135": {"label": label_mq135, "confidence": conf_mq135},
+        "mq2": {"label": label_mq2, "confidence": conf_mq2},
+        "mq7": {"label": label_mq7, "confidence": conf_mq7}
+    }
+    
+    # Publish Predictions to MQTT (all three sensors in one message). Updates
+    # are advisory and superseded on the next tick, so QoS 0 without retain,
+    # and nothing is sent while the predicted labels stay the same.
+    labels = (label_mq135, label_mq2, label_mq7)
+    if mqtt_client and labels != st.session_state.get('last_published_labels'):
+        mqtt_client.publish(
+            TOPIC_PRED_ALL, orjson.dumps(st.session_state.predictions), qos=0, retain=False
+        )
+        st.session_state.last_published_labels = labels
+    
+    # Update History (write at ring head, oldest rows are overwritten)
+    n = min(len(batch), HISTORY_SIZE)
+    head = st.session_state.hist_head
+    pos = (head + np.arange(n)) % HISTORY_SIZE
+    hist = st.session_state.history
+    hist['time'][pos] = [wib_clock(ts) for *_, ts in batch[-n:]]
+    hist['Temp'][pos] = readings[-n:, 0]
+    hist['Hum'][pos] = readings[-n:, 1]
+    hist['MQ135'][pos] = readings[-n:, 2]
+    hist['MQ2'][pos] = readings[-n:, 3]
+    hist['MQ7'][pos] = readings[-n:, 4]
+    hist['Status_135'][pos] = labels_mq135[-n:]
+    hist['Status_MQ2'][pos] = labels_mq2[-n:]
+    hist['Status_MQ7'][pos] = labels_mq7[-n:]
+    st.session_state.hist_head = (head + n) % HISTORY_SIZE
+    st.session_state.hist_filled = min(st.session_state.hist_filled + n, HISTORY_SIZE)
+    st.session_state.dirty = True
 
 # --- UI Styling ---
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600&display=swap');
-html, body, [class*="css"] { font-family: 'Poppins', sans-serif; }
-.main-header { font-size: 2.5rem; font-weight: 600; color: #1e3a8a; text-align: center; }
-.metric-card {
-    background: white; padding: 20px; border-radius: 16px;
-    box-shadow: 0 4px 20px rgba(0,0,0,0.05); text-align: center;
-    border: 1px solid #e2e8f0; margin-bottom: 10px;
-}
-.metric-value { font-size: 2rem; font-weight: 700; color: #0f172a; }
-.metric-label { font-size: 0.9rem; color: #64748b; text-transform: uppercase; }
-.sensor-card {
-    padding: 20px; border-radius: 16px; color: white; text-align: center;
-    box-shadow: 0 8px 25px rgba(0,0,0,0.15); margin-bottom: 15px;
-}
-</style>
-""", unsafe_allow_html=True)
+st.markdown(CSS_BLOCK, unsafe_allow_html=True)
 
 # --- Header ---
-st.markdown('<div class="main-header">🧪 Lab Monitoring AI Dashboard</div>', unsafe_allow_html=True)
-st.markdown('<p style="text-align:center; color:#64748b;">Real-time Chemical Lab Safety Monitoring with 3 ML Models</p>', unsafe_allow_html=True)
+st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
 # --- Sensor Status Cards ---
 st.subheader("📊 Sensor Predictions")
 
-col1, col2, col3 = st.columns(3)
-
-# MQ-135 Card
-with col1:
-    p = st.session_state.predictions['mq135']
-    color = "#10b981" if p['label'] == "Baik" else "#f59e0b" if p['label'] == "Sedang" else "#ef4444"
-    st.markdown(f"""
-    <div class="sensor-card" style="background: linear-gradient(135deg, {color}, {color}cc);">
-        <h4 style="margin:0; opacity:0.9;">💨 MQ-135 (Air Quality)</h4>
-        <h2 style="margin:10px 0; font-size:2rem;">{p['label'].replace("_", " ")}</h2>
-        <p style="margin:0;">Confidence: {p['confidence']}%</p>
-        <p style="margin:5px 0 0 0; font-size:1.5rem;">{st.session_state.sensor_data['mq135']:.1f} ppm</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-# MQ-2 Card
-with col2:
-    p = st.session_state.predictions['mq2']
-    # Translate label to Indonesian
-    label_text = "BAHAYA!" if p['label'] == "smoke" else "AMAN"
-    color = "#ef4444" if p['label'] == "smoke" else "#10b981"
-    icon = "🔥" if p['label'] == "smoke" else "✅"
-    st.markdown(f"""
-    <div class="sensor-card" style="background: linear-gradient(135deg, {color}, {color}cc);">
-        <h4 style="margin:0; opacity:0.9;">{icon} MQ-2 (Smoke Detection)</h4>
-        <h2 style="margin:10px 0; font-size:2rem;">{label_text}</h2>
-        <p style="margin:0;">Confidence: {p['confidence']}%</p>
-        <p style="margin:5px 0 0 0; font-size:1.5rem;">{st.session_state.sensor_data['mq2']:.1f} ppm</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-# MQ-7 Card
-with col3:
-    p = st.session_state.predictions['mq7']
-    # Translate label to Indonesian
-    label_text = "BERBAHAYA!" if p['label'] == "smoke" else "NORMAL"
-    color = "#ef4444" if p['label'] == "smoke" else "#10b981"
-    icon = "☠️" if p['label'] == "smoke" else "✅"
-    st.markdown(f"""
-    <div class="sensor-card" style="background: linear-gradient(135deg, {color}, {color}cc);">
-        <h4 style="margin:0; opacity:0.9;">{icon} MQ-7 (CO/Gas Detection)</h4>
-        <h2 style="margin:10px 0; font-size:2rem;">{label_text}</h2>
-        <p style="margin:0;">Confidence: {p['confidence']}%</p>
-        <p style="margin:5px 0 0 0; font-size:1.5rem;">{st.session_state.sensor_data['mq7']:.1f} ppm</p>
-    </div>
-    """, unsafe_allow_html=True)
+for col, key in zip(st.columns(3), ('mq135', 'mq2', 'mq7')):
+    with col:
+        p = st.session_state.predictions[key]
+        color, icon, label_text = CARD_STYLE[key].get(
+            p['label'], ('#64748b', '❓', str(p['label']).replace("_", " "))
+        )
+        st.markdown(CARD_TEMPLATE.format(
+            color=color, icon=icon, title=CARD_TITLE[key], label=label_text,
+            confidence=p['confidence'], ppm=st.session_state.sensor_data[key]
+        ), unsafe_allow_html=True)
 
 # --- Environment Metrics ---
 st.subheader("🌡️ Environment")
@@ -318,59 +511,104 @@ with c2:
 with c3:
     st.metric("Last Update", st.session_state.sensor_data['timestamp'])
 
+# --- Chart Builders ---
+def chart_values(values):
+    """float32 readings -> short float64 numbers for the vega-lite JSON"""
+    # float32 values repr as e.g. 1.100000023841858 once serialized
+    return values.astype(np.float64).round(3)
+
+# Only called when new readings arrive; the returned vega-lite dicts are
+# kept in st.session_state.history_view for reruns without new data.
+def build_gas_chart(df_melt):
+    """Vega-lite spec for the multi-line gas sensor chart"""
+    chart = alt.Chart(df_melt).mark_line(interpolate='monotone', strokeWidth=2).encode(
+        x=alt.X('step:Q', title='Time Steps'),
+        y=alt.Y('PPM:Q', title='Gas Concentration (ppm)'),
+        color=alt.Color('Sensor:N', scale=SENSOR_SCALE),
+        tooltip=['time', 'Sensor', 'PPM']
+    ).properties(height=350).interactive()
+    return chart.to_dict()
+
+def build_env_chart(df_env):
+    """Vega-lite spec for the temperature / humidity chart"""
+    base = alt.Chart(df_env).encode(x=alt.X('step:Q', title='Time Steps'))
+    
+    line_temp = base.mark_line(color='#ef4444', strokeWidth=2).encode(
+        y=alt.Y('Temp:Q', title='Temperature (°C)')
+    )
+    line_hum = base.mark_line(color='#3b82f6', strokeWidth=2).encode(
+        y=alt.Y('Hum:Q', title='Humidity (%)')
+    )
+    
+    chart = alt.layer(line_temp, line_hum).resolve_scale(y='independent').properties(height=350).interactive()
+    return chart.to_dict()
+
 # --- Charts ---
-if st.session_state.history:
+if st.session_state.hist_filled:
     st.subheader("📈 Trend Analysis")
     
-    df = pd.DataFrame(st.session_state.history)
-    df = df.reset_index(names='step')
+    if st.session_state.dirty:
+        # Oldest -> newest view of the ring buffer
+        n = st.session_state.hist_filled
+        head = st.session_state.hist_head
+        order = np.arange(head - n, head) % HISTORY_SIZE
+        hist = st.session_state.history
+        steps = np.arange(n)
+        cols = {col: hist[col][order] for col in HISTORY_COLUMNS}
+        # Columns stay float32; the gathered arrays are used without a copy
+        df = pd.DataFrame({'step': steps, **cols}, copy=False)
+        
+        # Long-form frame for the multi-line gas sensor chart, emitted
+        # straight from the gathered arrays (fixed-width, so tile/concat
+        # are plain buffer copies) instead of melting the wide frame
+        gas_cols = ['MQ135', 'MQ2', 'MQ7']
+        df_melt = pd.DataFrame({
+            'step': np.tile(steps, 3),
+            'time': np.tile(cols['time'], 3),
+            'Sensor': np.repeat(gas_cols, n),
+            'PPM': chart_values(np.concatenate([cols[col] for col in gas_cols])),
+        }, copy=False)
+        df_env = pd.DataFrame({
+            'step': steps,
+            'Temp': chart_values(cols['Temp']),
+            'Hum': chart_values(cols['Hum']),
+        }, copy=False)
+        
+        st.session_state.history_view = (df, build_gas_chart(df_melt), build_env_chart(df_env))
+        st.session_state.dirty = False
+    
+    # Reruns without new readings (widget clicks, reconnects) reuse the snapshot
+    df, gas_spec, env_spec = st.session_state.history_view
     
     tab1, tab2 = st.tabs(["💨 Gas Sensors", "🌡️ Environment"])
     
     with tab1:
-        # Multi-line chart for all gas sensors
-        df_melt = df.melt(id_vars=['step', 'time'], value_vars=['MQ135', 'MQ2', 'MQ7'],
-                         var_name='Sensor', value_name='PPM')
-        
-        chart = alt.Chart(df_melt).mark_line(interpolate='monotone', strokeWidth=2).encode(
-            x=alt.X('step:Q', title='Time Steps'),
-            y=alt.Y('PPM:Q', title='Gas Concentration (ppm)'),
-            color=alt.Color('Sensor:N', scale=alt.Scale(
-                domain=['MQ135', 'MQ2', 'MQ7'],
-                range=['#3b82f6', '#ef4444', '#f59e0b']
-            )),
-            tooltip=['time', 'Sensor', 'PPM']
-        ).properties(height=350).interactive()
-        
-        st.altair_chart(chart, use_container_width=True)
+        st.vega_lite_chart(spec=gas_spec, use_container_width=True)
     
     with tab2:
-        base = alt.Chart(df).encode(x=alt.X('step:Q', title='Time Steps'))
-        
-        line_temp = base.mark_line(color='#ef4444', strokeWidth=2).encode(
-            y=alt.Y('Temp:Q', title='Temperature (°C)')
-        )
-        line_hum = base.mark_line(color='#3b82f6', strokeWidth=2).encode(
-            y=alt.Y('Hum:Q', title='Humidity (%)')
-        )
-        
-        chart = alt.layer(line_temp, line_hum).resolve_scale(y='independent').properties(height=350).interactive()
-        st.altair_chart(chart, use_container_width=True)
+        st.vega_lite_chart(spec=env_spec, use_container_width=True)
     
     # Data Table
     with st.expander("📄 Raw Data"):
         st.dataframe(df[['time', 'Temp', 'Hum', 'MQ135', 'MQ2', 'MQ7', 'Status_135', 'Status_MQ2', 'Status_MQ7']], 
                     use_container_width=True, hide_index=True)
         
+        # CSV is generated only when the button is clicked, not on every rerun
         st.download_button(
             "📥 Download CSV",
-            df.to_csv(index=False).encode('utf-8'),
+            lambda df=df: df.to_csv(index=False).encode('utf-8'),
             f"lab_monitor_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            "text/csv"
+            "text/csv",
+            on_click="ignore"
         )
 else:
     st.info("⏳ Waiting for sensor data...")
 
-# Auto-refresh
-time.sleep(2)
-st.rerun()
+# Auto-refresh: poll the MQTT queue in a fragment and only rerun the whole
+# app when a new message is waiting, instead of rebuilding every 2 s
+@st.fragment(run_every=REFRESH_INTERVAL)
+def poll_mqtt():
+    if st.session_state.mqtt_queue:
+        st.rerun()
+
+poll_mqtt()